@@ -1,11 +1,25 @@
 
 import os
+import time
+import array
+import random
+import hashlib
+import sqlite3
+import threading
+import asyncio
+import functools
 import logging
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Tuple, Literal
+import httpx
+import orjson
+import uvicorn
+import numpy as np
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, models
 
 # Configure logging
 logging.basicConfig(
@@ -21,10 +35,52 @@ load_dotenv()
 NOMIC_API_KEY = os.getenv("NOMIC_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+QDRANT_MAX_CONNECTIONS = int(os.getenv("QDRANT_MAX_CONNECTIONS", "64"))
+QDRANT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("QDRANT_MAX_KEEPALIVE_CONNECTIONS", "32"))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "128"))
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "16"))
+# os.cpu_count() ignores container CPU quotas, so default conservatively
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "2"))
+EMBED_MODEL = "nomic-embed-text-v1.5"
+# Micro-batching: concurrent embed requests are coalesced into one Nomic call
+EMBED_BATCH_MAX_WAIT_MS = int(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "10"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "256"))
+# Each flushed batch is split into mini-batches sent to Nomic concurrently
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", "96"))
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", "8"))
+# Content-addressed embedding cache; set EMBED_CACHE_PATH to empty to disable
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./.embedcache.sqlite3")
+EMBED_CACHE_TTL_SECONDS = int(os.getenv("EMBED_CACHE_TTL_SECONDS", str(30 * 86400)))
+# Near-duplicate query cache in front of Qdrant; off unless QVCACHE_CAPACITY > 0
+QVCACHE_CAPACITY = int(os.getenv("QVCACHE_CAPACITY", "0"))
+QVCACHE_THRESHOLD = float(os.getenv("QVCACHE_THRESHOLD", "0.97"))
+QVCACHE_TTL_SECONDS = int(os.getenv("QVCACHE_TTL_SECONDS", "300"))
+QVCACHE_VERIFY_RATE = float(os.getenv("QVCACHE_VERIFY_RATE", "0.05"))
 
-# Import Nomic - The credentials should be set by the Docker startup script
+# Blocking Nomic calls run here so they don't stall the event loop.
+# Module-level state like this is created once per uvicorn worker process.
+EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=EMBED_MAX_WORKERS)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on EMBED_EXECUTOR and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EMBED_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+# Import Nomic and authenticate once at startup rather than per request.
+# The Docker startup script also writes credentials, so a failed login is
+# logged but not fatal.
 try:
     import nomic
+    if NOMIC_API_KEY:
+        try:
+            nomic.login(NOMIC_API_KEY)
+            logger.info("Authenticated with Nomic")
+        except Exception as e:
+            logger.error(f"Nomic login failed: {e}")
     from nomic import embed
     logger.info("Successfully imported nomic.embed")
 except ImportError as e:
@@ -34,31 +90,419 @@ except Exception as e:
     logger.error(f"Unexpected error importing nomic: {e}")
     embed = None
 
-# Initialize Qdrant
+# Search with quantized vectors where the collection has them, then rescore
+# the oversampled candidates with the original vectors. Ignored by Qdrant for
+# collections without quantization.
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=QDRANT_HNSW_EF,
+    quantization=models.QuantizationSearchParams(
+        ignore=False,
+        rescore=True,
+        oversampling=QDRANT_OVERSAMPLING
+    )
+)
+
+# Initialize Qdrant - one shared client so connections are reused across requests
 qdrant_client = None
 if QDRANT_URL:
     try:
-        qdrant_client = QdrantClient(
+        qdrant_client = AsyncQdrantClient(
             url=QDRANT_URL,
             api_key=QDRANT_API_KEY,
-            timeout=10
+            grpc_port=QDRANT_GRPC_PORT,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            timeout=QDRANT_TIMEOUT,
+            # REST transport: HTTP/2 and a larger keep-alive pool for bursts
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=QDRANT_MAX_CONNECTIONS,
+                max_keepalive_connections=QDRANT_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=30
+            )
         )
         logger.info(f"Connected to Qdrant at {QDRANT_URL}")
     except Exception as e:
         logger.error(f"Failed to connect to Qdrant: {e}")
 
-app = FastAPI(title="Nomic RAG Server", version="1.0.0")
+class EmbeddingCache:
+    """SQLite-backed cache of embeddings keyed by a hash of (model, task_type, text)."""
+
+    # Expired rows are deleted at most this often, from the write path
+    PURGE_INTERVAL_SECONDS = 3600
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(text: str, model: str, task_type: str) -> bytes:
+        # NUL separators keep search_query and search_document entries apart
+        return hashlib.blake2b(f"{model}\x00{task_type}\x00{text}".encode(), digest_size=32).digest()
+
+    @staticmethod
+    def as_stored(vector: List[float]) -> List[float]:
+        """Round a vector to the float32 precision it is stored with."""
+        return array.array("f", vector).tolist()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        if not keys:
+            return {}
+        cutoff = time.time() - self.ttl_seconds
+        rows = []
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE created >= ? AND key IN ({placeholders})",
+                    [cutoff, *chunk]
+                ).fetchall())
+        return {key: array.array("f", vector).tolist() for key, vector in rows}
+
+    def put_many(self, items: Dict[bytes, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                [(key, array.array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            if now - self._last_purge >= self.PURGE_INTERVAL_SECONDS:
+                self._conn.execute("DELETE FROM embeddings WHERE created < ?", (now - self.ttl_seconds,))
+                self._last_purge = now
+            self._conn.commit()
+
+embed_cache: Optional[EmbeddingCache] = None
+if EMBED_CACHE_PATH:
+    try:
+        embed_cache = EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_TTL_SECONDS)
+        logger.info(f"Embedding cache enabled at {EMBED_CACHE_PATH}")
+    except Exception as e:
+        logger.error(f"Failed to open embedding cache: {e}")
+
+class QueryVectorCache:
+    """Ring buffer of recent (query vector, results) pairs for near-duplicate queries.
+
+    Every entry carries its own similarity threshold. A sample of hits is
+    re-checked against Qdrant: matching results relax the entry's threshold
+    towards the observed similarity, mismatches tighten it past it.
+    """
+
+    def __init__(self, capacity: int, threshold: float, ttl_seconds: int):
+        self.capacity = capacity
+        self.default_threshold = threshold
+        self.min_threshold = threshold - 0.05
+        self.ttl_seconds = ttl_seconds
+        self.vectors: Optional[np.ndarray] = None  # (capacity, dim), unit length
+        self._scores: Optional[np.ndarray] = None  # reused output buffer for lookups
+        self.thresholds = np.full(capacity, threshold, dtype=np.float32)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.key_ids = np.full(capacity, -1, dtype=np.int64)
+        self.results: List[Optional[list]] = [None] * capacity
+        # Key ids are freed once no slot refers to them, so the number of
+        # distinct (collection, limit, score_threshold) keys is bounded by capacity
+        self._key_index: Dict[tuple, int] = {}
+        self._key_refs: Dict[int, int] = {}
+        self._key_names: Dict[int, tuple] = {}
+        self._next_key_id = 0
+        self.size = 0
+        self.next = 0
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        q = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        return q / norm if norm else q
+
+    def lookup(self, key: tuple, q: np.ndarray) -> Optional[Tuple[int, float, float, list]]:
+        """Return (slot, similarity, created, results) for the best matching entry."""
+        kid = self._key_index.get(key)
+        if kid is None or self.vectors is None or q.shape[0] != self.vectors.shape[1]:
+            return None
+        n = self.size
+        # Rows are unit length, so cosine similarity is a single BLAS sgemv
+        scores = self._scores[:n]
+        np.dot(self.vectors[:n], q, out=scores)
+        stale = (self.key_ids[:n] != kid) | (self.created[:n] < time.time() - self.ttl_seconds)
+        scores[stale] = -np.inf
+        slot = int(np.argmax(scores))
+        similarity = float(scores[slot])
+        if similarity < self.thresholds[slot]:
+            return None
+        return slot, similarity, float(self.created[slot]), self.results[slot]
+
+    def insert(self, key: tuple, q: np.ndarray, results: list):
+        if self.vectors is None:
+            self.vectors = np.zeros((self.capacity, q.shape[0]), dtype=np.float32)
+            self._scores = np.empty(self.capacity, dtype=np.float32)
+        elif q.shape[0] != self.vectors.shape[1]:
+            return
+        slot = self.next
+        self._release_key(int(self.key_ids[slot]))
+        self.vectors[slot] = q
+        self.thresholds[slot] = self.default_threshold
+        self.created[slot] = time.time()
+        self.key_ids[slot] = self._acquire_key(key)
+        self.results[slot] = results
+        self.next = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _acquire_key(self, key: tuple) -> int:
+        kid = self._key_index.get(key)
+        if kid is None:
+            kid = self._next_key_id
+            self._next_key_id += 1
+            self._key_index[key] = kid
+            self._key_names[kid] = key
+            self._key_refs[kid] = 0
+        self._key_refs[kid] += 1
+        return kid
+
+    def _release_key(self, kid: int):
+        if kid < 0:
+            return
+        self._key_refs[kid] -= 1
+        if self._key_refs[kid] == 0:
+            del self._key_refs[kid]
+            del self._key_index[self._key_names.pop(kid)]
+
+    def feedback(self, slot: int, created: float, similarity: float, correct: bool, results: list):
+        """Adjust an entry's threshold after verifying a hit against Qdrant."""
+        if self.created[slot] != created:
+            return  # slot was reused in the meantime
+        if correct:
+            relaxed = 0.9 * self.thresholds[slot] + 0.1 * (similarity - 0.01)
+            self.thresholds[slot] = max(self.min_threshold, relaxed)
+        else:
+            self.thresholds[slot] = max(self.thresholds[slot], similarity + 0.01)
+        self.results[slot] = results
+
+query_cache: Optional[QueryVectorCache] = None
+if QVCACHE_CAPACITY > 0:
+    query_cache = QueryVectorCache(QVCACHE_CAPACITY, QVCACHE_THRESHOLD, QVCACHE_TTL_SECONDS)
+
+# Embedding micro-batcher
+embed_queue: Optional[asyncio.Queue] = None
+embed_semaphore: Optional[asyncio.Semaphore] = None
+batcher_task: Optional[asyncio.Task] = None
+flush_tasks = set()
+
+async def embed_uncached(texts: List[str], task_type: str) -> List[List[float]]:
+    """Queue texts for the micro-batcher and wait for their embeddings."""
+    if not texts:
+        return []
+    future = asyncio.get_running_loop().create_future()
+    await embed_queue.put((texts, task_type, future))
+    return await future
+
+async def embed_texts(texts: List[str], task_type: str) -> List[List[float]]:
+    """Return embeddings for texts, serving repeats from the cache."""
+    if embed_cache is None:
+        return await embed_uncached(texts, task_type)
+
+    keys = [EmbeddingCache.key(text, EMBED_MODEL, task_type) for text in texts]
+    try:
+        cached = await run_blocking(embed_cache.get_many, list(set(keys)))
+    except Exception as e:
+        # e.g. "database is locked" between workers; treat as a miss
+        logger.warning(f"Failed to read embedding cache: {e}")
+        cached = {}
+
+    # Embed each missing text once, even if it repeats within the request
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    if missing:
+        computed = await embed_uncached(list(missing.values()), task_type)
+        # Round fresh vectors like cached ones so hits and misses match
+        new_entries = {key: EmbeddingCache.as_stored(vector) for key, vector in zip(missing.keys(), computed)}
+        try:
+            await run_blocking(embed_cache.put_many, new_entries)
+        except Exception as e:
+            logger.warning(f"Failed to write embedding cache: {e}")
+        cached.update(new_entries)
+
+    return [cached[key] for key in keys]
+
+async def embed_chunk(texts: List[str], task_type: str) -> List[List[float]]:
+    """Embed one mini-batch, limited to EMBED_MAX_INFLIGHT concurrent Nomic calls."""
+    async with embed_semaphore:
+        output = await run_blocking(
+            embed.text,
+            texts=texts,
+            model=EMBED_MODEL,
+            task_type=task_type
+        )
+
+    embeddings = output.get('embeddings') if output else None
+    if not embeddings:
+        # Nomic's output may describe the error; log it rather than sending
+        # it to clients, who may not even own the texts in this batch
+        logger.error(f"Nomic returned no embeddings: {output!r}")
+        raise RuntimeError("Nomic returned no embeddings")
+    return embeddings
+
+def is_input_error(error: BaseException) -> bool:
+    """Whether Nomic rejected the texts themselves (a 4xx other than 429).
+
+    nomic raises Exception((status_code, body)) for non-200 API responses.
+    """
+    args = getattr(error, "args", ())
+    if len(args) == 1 and isinstance(args[0], tuple) and args[0] and isinstance(args[0][0], int):
+        status = args[0][0]
+        return 400 <= status < 500 and status != 429
+    return False
+
+def settle(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    """Resolve a caller's future unless it was already cancelled."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+async def embed_alone(texts: List[str], task_type: str, future: asyncio.Future):
+    """Embed one request's texts outside the merged batch and resolve its future."""
+    try:
+        chunks = await asyncio.gather(*(
+            embed_chunk(texts[start:start + EMBED_CHUNK_SIZE], task_type)
+            for start in range(0, len(texts), EMBED_CHUNK_SIZE)
+        ))
+        settle(future, [vector for chunk in chunks for vector in chunk])
+    except Exception as e:
+        settle(future, error=e)
+
+async def flush_batch(task_type: str, items):
+    """Embed all queued texts for one task_type as concurrent mini-batches."""
+    try:
+        await embed_batch(task_type, items)
+    except Exception as e:
+        # Never leave a caller waiting on an unresolved future
+        for _, _, future in items:
+            settle(future, error=e)
+
+async def embed_batch(task_type: str, items):
+    # owner[i] is the index in items of the request that sent text i
+    all_texts = []
+    owner = []
+    for n, (texts, _, _) in enumerate(items):
+        all_texts.extend(texts)
+        owner.extend([n] * len(texts))
+
+    # Send texts shortest-first so each batch pads to a similar length
+    order = sorted(range(len(all_texts)), key=lambda i: len(all_texts[i]))
+    sorted_texts = [all_texts[i] for i in order]
+    starts = range(0, len(sorted_texts), EMBED_CHUNK_SIZE)
+    chunks = await asyncio.gather(*(
+        embed_chunk(sorted_texts[start:start + EMBED_CHUNK_SIZE], task_type)
+        for start in starts
+    ), return_exceptions=True)
+
+    # Unsort successful chunks; map failed ones back to the requests they hold
+    embeddings = [None] * len(order)
+    failed: Dict[int, BaseException] = {}
+    shared = set()
+    for start, chunk in zip(starts, chunks):
+        positions = order[start:start + EMBED_CHUNK_SIZE]
+        if isinstance(chunk, BaseException):
+            owners = {owner[i] for i in positions}
+            for n in owners:
+                failed.setdefault(n, chunk)
+            # Only a rejection of the texts themselves is worth retrying per
+            # request; splitting on timeouts, 429s or outages multiplies load
+            if len(owners) > 1 and is_input_error(chunk):
+                shared.update(owners)
+        else:
+            for i, vector in zip(positions, chunk):
+                embeddings[i] = vector
+
+    retries = []
+    offset = 0
+    for n, (texts, _, future) in enumerate(items):
+        if n not in failed:
+            settle(future, embeddings[offset:offset + len(texts)])
+        elif n in shared:
+            # The failed chunk mixed several requests; retry each on its own
+            # so a bad input only fails the request that sent it
+            retries.append(embed_alone(texts, task_type, future))
+        else:
+            settle(future, error=failed[n])
+        offset += len(texts)
+
+    if retries:
+        logger.warning(f"Embedding chunk failed, retrying {len(retries)} requests individually")
+        await asyncio.gather(*retries)
+
+async def batcher_loop():
+    """Collect queued requests for up to EMBED_BATCH_MAX_WAIT_MS and flush them."""
+    loop = asyncio.get_running_loop()
+    while True:
+        pending = [await embed_queue.get()]
+        total = len(pending[0][0])
+        deadline = loop.time() + EMBED_BATCH_MAX_WAIT_MS / 1000
+        while total < EMBED_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(embed_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending.append(item)
+            total += len(item[0])
+
+        # Nomic accepts a single task_type per call
+        by_task_type: Dict[str, list] = {}
+        for item in pending:
+            by_task_type.setdefault(item[1], []).append(item)
+        for task_type, items in by_task_type.items():
+            task = asyncio.create_task(flush_batch(task_type, items))
+            flush_tasks.add(task)
+            task.add_done_callback(flush_tasks.discard)
+
+app = FastAPI(title="Nomic RAG Server", version="1.0.0", default_response_class=ORJSONResponse)
+
+@app.on_event("startup")
+async def startup():
+    global embed_queue, embed_semaphore, batcher_task, HEALTH_BODY
+    if embed is None:
+        logger.error("Nomic embed module not loaded; /embed and /search will fail")
+    else:
+        logger.info("Nomic embed module ready")
+    embed_queue = asyncio.Queue()
+    embed_semaphore = asyncio.Semaphore(EMBED_MAX_INFLIGHT)
+    batcher_task = asyncio.create_task(batcher_loop())
+    HEALTH_BODY = build_health_body()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if batcher_task:
+        batcher_task.cancel()
 
 @app.get("/")
 async def root():
-    return {"message": "Nomic RAG Server is running", "endpoints": ["/health", "/search", "/embed", "/debug"]}
+    return {"message": "Nomic RAG Server is running", "endpoints": ["/health", "/search", "/search_batch", "/embed", "/debug"]}
+
+TaskType = Literal["search_query", "search_document", "classification", "clustering"]
 
 class SearchRequest(BaseModel):
     query: str
     collection_name: str
-    limit: int = 5
-    score_threshold: float = 0.0
-    task_type: str = "search_query"
+    limit: int = Field(5, ge=1, le=1000)
+    score_threshold: float = Field(0.0, allow_inf_nan=False)
+    task_type: TaskType = "search_query"
 
 class SearchResult(BaseModel):
     id: Any
@@ -68,22 +512,41 @@ class SearchResult(BaseModel):
 class SearchResponse(BaseModel):
     results: List[SearchResult]
     query_embedding_sample: List[float] = Field(..., description="First 5 dimensions of embedding for verification")
+    cache_hit: bool = Field(False, description="Results were served from the query vector cache")
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    collection_name: str
+    limit: int = Field(5, ge=1, le=1000)
+    score_threshold: float = Field(0.0, allow_inf_nan=False)
+    task_type: TaskType = "search_query"
+
+class BatchSearchResponse(BaseModel):
+    results: List[List[SearchResult]]
 
 class EmbedRequest(BaseModel):
     texts: List[str]
-    task_type: str = "search_document"
+    task_type: TaskType = "search_document"
 
 class EmbedResponse(BaseModel):
     embeddings: List[List[float]]
 
-@app.get("/health")
-async def health_check():
-    return {
+def build_health_body() -> bytes:
+    return orjson.dumps({
         "status": "healthy",
         "nomic_key_configured": bool(NOMIC_API_KEY),
         "nomic_embed_loaded": embed is not None,
         "qdrant_configured": bool(qdrant_client)
-    }
+    })
+
+# embed and qdrant_client are fixed after import, so the health body is
+# encoded once at startup. Each probe still gets its own Response, since
+# FastAPI and middleware mutate the returned object.
+HEALTH_BODY: Optional[bytes] = None
+
+@app.get("/health")
+async def health_check():
+    return Response(HEALTH_BODY or build_health_body(), media_type="application/json")
 
 @app.get("/debug")
 async def debug_info():
@@ -110,31 +573,28 @@ async def debug_info():
         "import_status": "Success" if embed else "Failed"
     }
 
-@app.post("/embed", response_model=EmbedResponse)
+def format_points(points) -> List[Dict[str, Any]]:
+    return [{"id": p.id, "score": p.score, "payload": p.payload or {}} for p in points]
+
+# Responses built from trusted Nomic/Qdrant data are returned directly, which
+# skips response_model validation; the models still document the schema.
+@app.post("/embed", responses={200: {"model": EmbedResponse}})
 async def generate_embeddings(request: EmbedRequest):
     if embed is None:
         raise HTTPException(status_code=500, detail="Nomic library not initialized.")
         
     try:
         logger.info(f"Generating embeddings for {len(request.texts)} texts")
-        output = embed.text(
-            texts=request.texts,
-            model='nomic-embed-text-v1.5'
-        )
-        
-        if not output or 'embeddings' not in output:
-             # Check if output contains an error message from Nomic API
-             error_msg = str(output) if output else "No output"
-             raise HTTPException(status_code=500, detail=f"Failed to generate embeddings: {error_msg}")
-             
-        return {"embeddings": output['embeddings']}
-    except Exception as e:
-        logger.error(f"Embedding error: {str(e)}")
-        import traceback
-        raise HTTPException(status_code=500, detail=f"{str(e)} | {traceback.format_exc()}")
+        embeddings = await embed_texts(request.texts, request.task_type)
+        return ORJSONResponse({"embeddings": embeddings})
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Embedding error")
+        raise HTTPException(status_code=500, detail="embedding_failed")
 
 
-@app.post("/search", response_model=SearchResponse)
+@app.post("/search", responses={200: {"model": SearchResponse}})
 async def search(request: SearchRequest):
     if embed is None:
         raise HTTPException(status_code=500, detail="Nomic library not initialized.")
@@ -144,45 +604,104 @@ async def search(request: SearchRequest):
     try:
         # 1. Generate Embedding
         logger.info(f"Generating embedding for query: '{request.query}'")
-        output = embed.text(
-            texts=[request.query],
-            model='nomic-embed-text-v1.5'
-        )
-        
-        if not output or 'embeddings' not in output:
-            raise HTTPException(status_code=500, detail="Failed to generate embeddings")
-            
-        params = output.get('usage', {}) 
-        query_vector = output['embeddings'][0]
-        
-        # 2. Search Qdrant
+        query_vector = (await embed_texts([request.query], request.task_type))[0]
+
+        # 2. Check for a recent near-duplicate query
+        cache_key = (request.collection_name, request.limit, request.score_threshold)
+        hit = None
+        if query_cache is not None:
+            q_unit = QueryVectorCache.normalize(query_vector)
+            hit = query_cache.lookup(cache_key, q_unit)
+            if hit is not None and random.random() >= QVCACHE_VERIFY_RATE:
+                return ORJSONResponse({
+                    "results": hit[3],
+                    "query_embedding_sample": np.asarray(query_vector[:5]),
+                    "cache_hit": True
+                })
+
+        # 3. Search Qdrant
         logger.info(f"Searching Qdrant collection '{request.collection_name}'")
-        search_result = qdrant_client.search(
+        search_result = await qdrant_client.search(
             collection_name=request.collection_name,
             query_vector=query_vector,
             limit=request.limit,
-            score_threshold=request.score_threshold
+            score_threshold=request.score_threshold,
+            search_params=SEARCH_PARAMS,
+            with_payload=True,
+            with_vectors=False
         )
-        
-        # 3. Format Response
-        formatted_results = []
-        for hit in search_result:
-            formatted_results.append({
-                "id": hit.id,
-                "score": hit.score,
-                "payload": hit.payload or {}
-            })
-            
-        return {
+
+        # 4. Format Response
+        formatted_results = format_points(search_result)
+
+        if query_cache is not None:
+            if hit is None:
+                query_cache.insert(cache_key, q_unit, formatted_results)
+            else:
+                slot, similarity, created, cached_results = hit
+                correct = [r["id"] for r in cached_results] == [r["id"] for r in formatted_results]
+                query_cache.feedback(slot, created, similarity, correct, formatted_results)
+
+        # orjson serializes the numpy slice natively
+        return ORJSONResponse({
             "results": formatted_results,
-            "query_embedding_sample": query_vector[:5]
-        }
+            "query_embedding_sample": np.asarray(query_vector[:5]),
+            "cache_hit": False
+        })
 
-    except Exception as e:
-        logger.error(f"Search error: {str(e)}")
-        import traceback
-        raise HTTPException(status_code=500, detail=f"{str(e)} | {traceback.format_exc()}")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Search error")
+        raise HTTPException(status_code=500, detail="search_failed")
+
+@app.post("/search_batch", responses={200: {"model": BatchSearchResponse}})
+async def search_batch(request: BatchSearchRequest):
+    if embed is None:
+        raise HTTPException(status_code=500, detail="Nomic library not initialized.")
+    if not qdrant_client:
+        raise HTTPException(status_code=500, detail="Qdrant client not initialized")
+
+    try:
+        # 1. Generate all query embeddings in one batch
+        logger.info(f"Generating embeddings for {len(request.queries)} queries")
+        query_vectors = await embed_texts(request.queries, request.task_type)
+
+        # 2. Search Qdrant with a single batched request
+        logger.info(f"Batch searching Qdrant collection '{request.collection_name}'")
+        responses = await qdrant_client.query_batch_points(
+            collection_name=request.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=vector,
+                    limit=request.limit,
+                    score_threshold=request.score_threshold,
+                    params=SEARCH_PARAMS,
+                    with_payload=True,
+                    with_vector=False
+                )
+                for vector in query_vectors
+            ]
+        )
+
+        # 3. Format Response
+        return ORJSONResponse({
+            "results": [format_points(response.points) for response in responses]
+        })
+
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Batch search error")
+        raise HTTPException(status_code=500, detail="batch_search_failed")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=10000)
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=10000,
+        workers=UVICORN_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        log_level="info"
+    )
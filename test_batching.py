@@ -0,0 +1,218 @@
+import os
+import asyncio
+import inspect
+
+import numpy as np
+import pytest
+
+import dotenv
+
+# Import server without a developer's .env, a network Nomic login, an
+# on-disk cache or a Qdrant client
+dotenv.load_dotenv = lambda *args, **kwargs: False
+os.environ["EMBED_CACHE_PATH"] = ""
+os.environ.pop("QDRANT_URL", None)
+os.environ.pop("NOMIC_API_KEY", None)
+
+import server
+from nomic import embed as nomic_embed
+
+# Calls to the stub are checked against the installed nomic API, so a
+# kwarg the real embed.text doesn't accept fails here too
+NOMIC_TEXT_SIGNATURE = inspect.signature(nomic_embed.text)
+
+
+class StubEmbed:
+    """Stands in for nomic.embed; records every call it receives."""
+
+    def __init__(self, fail_on=None, status=400):
+        self.fail_on = fail_on
+        self.status = status
+        self.calls = []
+
+    def text(self, texts, **kwargs):
+        NOMIC_TEXT_SIGNATURE.bind(texts, **kwargs)
+        self.calls.append(list(texts))
+        if self.fail_on and self.fail_on in texts:
+            # nomic's error for a non-200 API response
+            raise Exception((self.status, f"bad input: {self.fail_on}"))
+        return {"embeddings": [[float(len(t)), float(ord(t[0]))] for t in texts]}
+
+
+def vector_for(text):
+    return [float(len(text)), float(ord(text[0]))]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    embed = StubEmbed()
+    monkeypatch.setattr(server, "embed", embed)
+    monkeypatch.setattr(server, "embed_cache", None)
+    return embed
+
+
+def run(make_awaitable):
+    """Await make_awaitable() with the micro-batcher started, as the startup hook does."""
+    async def main():
+        server.embed_queue = asyncio.Queue()
+        server.embed_semaphore = asyncio.Semaphore(server.EMBED_MAX_INFLIGHT)
+        task = asyncio.create_task(server.batcher_loop())
+        try:
+            return await make_awaitable()
+        finally:
+            task.cancel()
+    return asyncio.run(main())
+
+
+def test_coalesced_requests_keep_their_order(stub, monkeypatch):
+    monkeypatch.setattr(server, "EMBED_CHUNK_SIZE", 2)
+    requests = [["aaaa", "b", "ccccccc"], ["dd"], ["eee", "f", "gggggg"]]
+
+    results = run(lambda: asyncio.gather(*(
+        server.embed_texts(texts, "search_document") for texts in requests
+    )))
+
+    assert results == [[vector_for(t) for t in texts] for texts in requests]
+    sent = [text for call in stub.calls for text in call]
+    assert sorted(sent) == sorted(t for texts in requests for t in texts)
+    # Texts are sent to Nomic shortest-first
+    assert [len(t) for t in sent] == sorted(len(t) for t in sent)
+
+
+def test_failure_only_reaches_the_request_that_caused_it(stub):
+    stub.fail_on = "BAD"
+
+    results = run(lambda: asyncio.gather(
+        server.embed_texts(["good"], "search_document"),
+        server.embed_texts(["BAD"], "search_document"),
+        return_exceptions=True
+    ))
+
+    assert results[0] == [vector_for("good")]
+    assert results[1].args[0][0] == 400
+
+
+def test_failed_chunk_does_not_fail_other_chunks(stub, monkeypatch):
+    monkeypatch.setattr(server, "EMBED_CHUNK_SIZE", 1)
+    stub.fail_on = "BAD"
+
+    results = run(lambda: asyncio.gather(
+        server.embed_texts(["one", "two"], "search_document"),
+        server.embed_texts(["BAD", "three"], "search_document"),
+        return_exceptions=True
+    ))
+
+    assert results[0] == [vector_for("one"), vector_for("two")]
+    assert results[1].args[0][0] == 400
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_transient_errors_are_not_retried_per_request(stub, status):
+    stub.fail_on = "BAD"
+    stub.status = status
+
+    results = run(lambda: asyncio.gather(
+        server.embed_texts(["good"], "search_document"),
+        server.embed_texts(["BAD"], "search_document"),
+        return_exceptions=True
+    ))
+
+    assert all(isinstance(result, Exception) for result in results)
+    assert len(stub.calls) == 1
+
+
+def test_empty_output_is_not_sent_to_clients(stub, monkeypatch):
+    monkeypatch.setattr(stub, "text", lambda texts, **kwargs: {"error": "secret"})
+
+    with pytest.raises(RuntimeError) as excinfo:
+        run(lambda: server.embed_texts(["x"], "search_document"))
+    assert "secret" not in str(excinfo.value)
+
+
+def test_embedding_cache_hit_and_miss(stub, monkeypatch, tmp_path):
+    cache = server.EmbeddingCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    monkeypatch.setattr(server, "embed_cache", cache)
+
+    first = run(lambda: server.embed_texts(["alpha", "beta", "alpha"], "search_document"))
+    second = run(lambda: server.embed_texts(["beta", "alpha"], "search_document"))
+    other_task = run(lambda: server.embed_texts(["alpha"], "search_query"))
+
+    assert first == [vector_for("alpha"), vector_for("beta"), vector_for("alpha")]
+    assert second == [vector_for("beta"), vector_for("alpha")]
+    assert other_task == [vector_for("alpha")]
+    # Repeats within a request and across requests are embedded once per task_type
+    assert stub.calls == [["beta", "alpha"], ["alpha"]]
+
+
+def test_embedding_cache_hits_and_misses_return_the_same_values(stub, monkeypatch, tmp_path):
+    cache = server.EmbeddingCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    monkeypatch.setattr(server, "embed_cache", cache)
+    monkeypatch.setattr(stub, "text", lambda texts, **kwargs: {"embeddings": [[0.1, -0.3] for _ in texts]})
+
+    miss = run(lambda: server.embed_texts(["alpha"], "search_document"))
+    hit = run(lambda: server.embed_texts(["alpha"], "search_document"))
+
+    assert miss == hit
+    assert miss[0] == pytest.approx([0.1, -0.3])
+
+
+def test_embedding_cache_read_error_is_a_miss(stub, monkeypatch, tmp_path):
+    cache = server.EmbeddingCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    monkeypatch.setattr(server, "embed_cache", cache)
+
+    def locked(keys):
+        raise server.sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(cache, "get_many", locked)
+
+    assert run(lambda: server.embed_texts(["alpha"], "search_document")) == [vector_for("alpha")]
+
+
+def test_embedding_cache_purges_expired_rows(tmp_path):
+    cache = server.EmbeddingCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=0)
+    key = server.EmbeddingCache.key("alpha", "m", "search_document")
+
+    cache.put_many({key: [0.5, 0.25]})
+    cache._last_purge = 0
+    cache.put_many({server.EmbeddingCache.key("beta", "m", "search_document"): [1.0]})
+
+    rows = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert rows == 1
+
+
+def test_query_cache_hit_requires_same_key_and_similarity():
+    cache = server.QueryVectorCache(capacity=4, threshold=0.95, ttl_seconds=60)
+    q = server.QueryVectorCache.normalize([1.0, 0.0])
+    results = [{"id": 1, "score": 0.9, "payload": {}}]
+    cache.insert(("docs", 5, 0.0), q, results)
+
+    assert cache.lookup(("docs", 5, 0.0), q)[3] == results
+    assert cache.lookup(("docs", 10, 0.0), q) is None
+    far = server.QueryVectorCache.normalize([0.0, 1.0])
+    assert cache.lookup(("docs", 5, 0.0), far) is None
+
+
+def test_query_cache_feedback_adjusts_threshold():
+    cache = server.QueryVectorCache(capacity=4, threshold=0.95, ttl_seconds=60)
+    key = ("docs", 5, 0.0)
+    cache.insert(key, server.QueryVectorCache.normalize([1.0, 0.0]), [])
+    near = server.QueryVectorCache.normalize([1.0, 0.2])
+    slot, similarity, created, _ = cache.lookup(key, near)
+
+    cache.feedback(slot, created, similarity, correct=False, results=[])
+    assert cache.thresholds[slot] > similarity
+    assert cache.lookup(key, near) is None
+
+    before = float(cache.thresholds[slot])
+    cache.feedback(slot, created, similarity, correct=True, results=[])
+    assert cache.min_threshold <= cache.thresholds[slot] < before
+
+
+def test_query_cache_frees_unused_keys():
+    cache = server.QueryVectorCache(capacity=2, threshold=0.95, ttl_seconds=60)
+    q = server.QueryVectorCache.normalize(np.ones(3))
+    for limit in range(1, 50):
+        cache.insert(("docs", limit, 0.0), q, [])
+
+    assert len(cache._key_index) == 2
+    assert cache.lookup(("docs", 49, 0.0), q) is not None
+    assert cache.lookup(("docs", 1, 0.0), q) is None
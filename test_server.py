@@ -42,6 +42,33 @@ def test_search():
     except Exception as e:
         print(f"Search request failed: {e}")
 
+def test_search_batch():
+    queries = [
+        "What is the recommended treatment for diabetes?",
+        "What are the symptoms of hypertension?"
+    ]
+    collection = "medical_guidelines"
+
+    print(f"\nTesting batch search at {URL}/search_batch...")
+    print(f"Queries: {queries}, Collection: '{collection}'")
+
+    payload = {
+        "queries": queries,
+        "collection_name": collection,
+        "limit": 3
+    }
+
+    try:
+        res = requests.post(f"{URL}/search_batch", json=payload)
+        if res.status_code == 200:
+            results = res.json().get("results", [])
+            for query, hits in zip(queries, results):
+                print(f"'{query}': {len(hits)} results")
+        else:
+            print(f"Batch search failed with {res.status_code}: {res.text}")
+    except Exception as e:
+        print(f"Batch search request failed: {e}")
+
 if __name__ == "__main__":
     print("--- Nomic RAG Server Tester ---")
     print("Ensure the server is running on localhost:10000")
@@ -51,3 +78,4 @@ if __name__ == "__main__":
     val = input("\nDo you want to run the search test? (Requires valid keys in server .env) [y/N]: ")
     if val.lower() == 'y':
         test_search()
+        test_search_batch()